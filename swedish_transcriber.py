@@ -5,98 +5,539 @@ Uses KBLab/kb-whisper-large model to transcribe Swedish audio files
 """
 
 import argparse
+import hashlib
+import importlib.util
+import logging
 import os
+import shutil
+import subprocess
 import sys
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import torch
-from transformers import WhisperProcessor, WhisperForConditionalGeneration
-import librosa
+import torchaudio
+import soundfile as sf
+from transformers import WhisperProcessor, WhisperForConditionalGeneration, TextStreamer
+from transformers.modeling_outputs import BaseModelOutput
 import warnings
 
 # Suppress some warnings for cleaner output
 warnings.filterwarnings("ignore", category=UserWarning)
 
+# Progress messages, silent unless the application configures logging (as main() does)
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+class TokenQueueStreamer(TextStreamer):
+    """TextStreamer that hands decoded text to a queue instead of printing it."""
+    
+    def __init__(self, tokenizer, text_queue):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.text_queue = text_queue
+    
+    def on_finalized_text(self, text, stream_end=False):
+        if text:
+            self.text_queue.put(text)
+
 class SwedishTranscriber:
-    def __init__(self, model_name="KBLab/kb-whisper-large"):
-        """Initialize the Swedish transcriber with the specified model."""
-        print(f"Loading model: {model_name}")
-        print("This may take a few minutes on first run...")
+    # Number of clips whose encoder outputs are kept around for repeated inputs
+    ENCODER_CACHE_SIZE = 8
+    # Generous speech rate used to cap generation length, fast speech must not be cut off
+    TOKENS_PER_SECOND = 6
+    # Samples in one 30 s Whisper window at 16kHz
+    N_SAMPLES = 480000
+    
+    def __init__(self, model_name="KBLab/kb-whisper-large", compile_model=False):
+        """Initialize the Swedish transcriber with the specified model.
+        
+        compile_model compiles the model with torch.compile on CUDA. That takes a few minutes
+        up front, so it only pays off in long-running processes such as the web apps.
+        """
+        logger.info("Loading model: %s", model_name)
+        logger.info("This may take a few minutes on first run...")
+        
+        # Optional backends, selected with KB_WHISPER_BACKEND: ctranslate2 (faster-whisper) or onnxruntime (optimum)
+        self.backend = os.environ.get("KB_WHISPER_BACKEND", "transformers")
         
-        # Check if CUDA is available
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"Using device: {self.device}")
+        # Check if CUDA is available, the ONNX Runtime backend always runs on CPU
+        self.device = "cuda" if torch.cuda.is_available() and self.backend != "onnxruntime" else "cpu"
+        logger.info("Using device: %s", self.device)
+        
+        if self.backend == "ctranslate2":
+            self._load_ctranslate2_model()
+            logger.info("Model loaded successfully!")
+            return
+        
+        # Half precision on GPU (bf16 on Ampere or newer, where it runs natively), fp32 weights on CPU
+        if self.device == "cuda":
+            # is_bf16_supported() also counts emulated bf16, which is slow on older GPUs such as T4/V100
+            self.dtype = torch.bfloat16 if torch.cuda.get_device_capability()[0] >= 8 else torch.float16
+            self.autocast_dtype = self.dtype
+        else:
+            self.dtype = torch.float32
+            # CPUs with native bf16 instructions can still run the matmuls in bf16 under autocast
+            bf16_check = getattr(torch.cpu, "_is_avx512_bf16_supported", None)
+            self.autocast_dtype = torch.bfloat16 if bf16_check and bf16_check() else None
+        
+        # FlashAttention-2 on Ampere or newer GPUs when flash-attn is installed, PyTorch SDPA otherwise
+        # (native SDPA supersedes optimum's BetterTransformer, which rejects Whisper on transformers>=4.36)
+        if (self.device == "cuda" and torch.cuda.get_device_capability()[0] >= 8
+                and importlib.util.find_spec("flash_attn") is not None):
+            self.attn_implementation = "flash_attention_2"
+        else:
+            self.attn_implementation = "sdpa"
         
         # Load the processor and model
-        try:
-            self.processor = WhisperProcessor.from_pretrained(model_name)
-            self.model = WhisperForConditionalGeneration.from_pretrained(model_name)
+        self._encoder_cache = OrderedDict()
+        self._encoder_graph = None
+        self._pinned_audio = None
+        self._upload_done = torch.cuda.Event() if self.device == "cuda" else None
+        self.processor = WhisperProcessor.from_pretrained(model_name)
+        if self.backend == "onnxruntime":
+            self._load_onnxruntime_model(model_name)
+        else:
+            # Materialize the weights once, directly in the target dtype, to keep peak memory down
+            self.model = WhisperForConditionalGeneration.from_pretrained(
+                model_name,
+                torch_dtype=self.dtype,
+                low_cpu_mem_usage=True,
+                attn_implementation=self.attn_implementation
+            )
             self.model.to(self.device)
-            print("Model loaded successfully!")
+        # Clear the deprecated forced_decoder_ids once, so the language and task passed to generate
+        # always decide the decoder prompt rather than a prompt stored with the model
+        self.model.config.forced_decoder_ids = None
+        self.model.generation_config.forced_decoder_ids = None
+        # Whisper's log-mel filterbank (Slaney scale and norm), built once on the model's device
+        self._mel = torchaudio.transforms.MelSpectrogram(
+            sample_rate=16000,
+            n_fft=400,
+            hop_length=160,
+            n_mels=self.model.config.num_mel_bins,
+            f_min=0.0,
+            f_max=8000.0,
+            power=2.0,
+            norm="slaney",
+            mel_scale="slaney"
+        ).to(self.device)
+        # The remaining optimizations only apply to the PyTorch model
+        if self.backend != "onnxruntime":
+            # int8 dynamic quantization on CPU, disable with KB_WHISPER_QUANT=none
+            quant = os.environ.get("KB_WHISPER_QUANT", "int8")
+            if quant not in ("int8", "none"):
+                logger.warning("Unknown KB_WHISPER_QUANT value '%s' (expected int8 or none), not quantizing", quant)
+            if self.device == "cpu" and quant == "int8":
+                self._quantize_model()
+            if self.device == "cuda":
+                if compile_model:
+                    self._compile_model()
+                self._capture_encoder_graph()
+        logger.info("Model loaded successfully!")
+    
+    def _load_ctranslate2_model(self):
+        """Load CTranslate2 weights converted from the Hugging Face model.
+
+        Convert once with:
+            ct2-transformers-converter --model KBLab/kb-whisper-large \\
+                --quantization int8_float16 --output_dir ./kb-whisper-ct2
+        """
+        from faster_whisper import WhisperModel
+        
+        model_path = os.environ.get("KB_WHISPER_CT2_MODEL", "./kb-whisper-ct2")
+        self.model = WhisperModel(
+            model_path,
+            device=self.device,
+            compute_type="int8_float16" if self.device == "cuda" else "int8"
+        )
+    
+    def _transcribe_ctranslate2(self, audio, language="sv", text_queue=None):
+        """Transcribe an audio file path or 16kHz array with the CTranslate2 backend."""
+        segments, _ = self.model.transcribe(audio, language=language, beam_size=1)
+        # Segments are decoded lazily, so each one can be passed on as soon as it's ready
+        texts = []
+        for segment in segments:
+            texts.append(segment.text.strip())
+            if text_queue is not None:
+                text_queue.put(segment.text)
+        return " ".join(texts)
+    
+    def _load_onnxruntime_model(self, model_name):
+        """Load the model as ONNX Runtime encoder/decoder sessions, exporting to ONNX on first use."""
+        from optimum.onnxruntime import ORTModelForSpeechSeq2Seq
+        
+        onnx_path = os.environ.get("KB_WHISPER_ONNX_MODEL", "./kb-whisper-onnx")
+        # CPU provider only, the CUDA one would need the separate onnxruntime-gpu package
+        # (and IO binding, which is CUDA-only in optimum, has nothing to bind on CPU)
+        ort_kwargs = dict(provider="CPUExecutionProvider", use_io_binding=False)
+        if os.path.isdir(onnx_path):
+            self.model = ORTModelForSpeechSeq2Seq.from_pretrained(onnx_path, **ort_kwargs)
+        else:
+            # One-off export, cached so later runs load the ONNX files directly
+            self.model = ORTModelForSpeechSeq2Seq.from_pretrained(model_name, export=True, **ort_kwargs)
+            self.model.save_pretrained(onnx_path)
+        # ONNX Runtime runs the exported fp32 graph, torch autocast has nothing to act on
+        self.autocast_dtype = None
+    
+    def _quantize_model(self):
+        """Dynamically quantize the linear layers to int8 for faster CPU inference."""
+        # Keep the output projection (Whisper's lm_head) in fp32 to preserve the token distribution
+        linear_layers = {
+            name for name, module in self.model.named_modules()
+            if isinstance(module, torch.nn.Linear) and name != "proj_out"
+        }
+        # Swap the layers in place so the fp32 and int8 copies of the model never coexist
+        self.model = torch.ao.quantization.quantize_dynamic(
+            self.model, linear_layers, dtype=torch.qint8, inplace=True
+        )
+        # Quantized linears expect fp32 activations, so bf16 autocast can't be combined with them
+        self.autocast_dtype = None
+        logger.info("Model quantized to int8")
+    
+    def _compile_model(self):
+        """Compile the model forward pass, falling back to eager mode if that fails."""
+        eager_forward = self.model.forward
+        
+        def forward(*args, **kwargs):
+            # Recompiles for new input shapes can fail on a real request too, switch to eager mode for good then
+            try:
+                return compiled_forward(*args, **kwargs)
+            except Exception as e:
+                logger.warning("torch.compile failed, using eager mode: %s", e)
+                self.model.forward = eager_forward
+                return eager_forward(*args, **kwargs)
+        
+        try:
+            compiled_forward = torch.compile(eager_forward, mode="reduce-overhead", dynamic=True)
+            self.model.forward = forward
+            # Compilation is lazy, so prime it with 30 s of silence to keep compile time off the first request
+            dummy_features = torch.zeros(
+                1, self.model.config.num_mel_bins, 3000,
+                device=self.device, dtype=self.model.dtype
+            )
+            with torch.no_grad():
+                self.model.generate(dummy_features, language="sv", task="transcribe", max_new_tokens=4)
         except Exception as e:
-            print(f"Error loading model: {e}")
-            sys.exit(1)
+            logger.warning("torch.compile failed, using eager mode: %s", e)
+            self.model.forward = eager_forward
+    
+    def _capture_encoder_graph(self):
+        """Capture the fixed-shape (one 30 s window) encoder pass in a CUDA graph."""
+        encoder = self.model.get_encoder()
+        self._encoder_input = torch.zeros(
+            1, self.model.config.num_mel_bins, 3000,
+            device=self.device, dtype=self.model.dtype
+        )
+        try:
+            with torch.no_grad():
+                # Warm up on a side stream before capturing, as CUDA graphs require
+                stream = torch.cuda.Stream()
+                stream.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(stream):
+                    for _ in range(3):
+                        encoder(self._encoder_input)
+                torch.cuda.current_stream().wait_stream(stream)
+                
+                self._encoder_graph = torch.cuda.CUDAGraph()
+                with torch.cuda.graph(self._encoder_graph):
+                    self._encoder_output = encoder(self._encoder_input).last_hidden_state
+        except Exception as e:
+            logger.warning("CUDA graph capture failed, running the encoder eagerly: %s", e)
+            self._encoder_graph = None
+    
+    def _host_audio_buffer(self, batch_size):
+        """Host buffer for a padded audio batch, a reused pinned buffer on CUDA."""
+        if self.device != "cuda":
+            return torch.empty(batch_size, self.N_SAMPLES)
+        if self._pinned_audio is None or self._pinned_audio.shape[0] < batch_size:
+            self._pinned_audio = torch.empty(batch_size, self.N_SAMPLES, pin_memory=True)
+        else:
+            # Don't overwrite the buffer while its previous upload may still be in flight
+            self._upload_done.synchronize()
+        return self._pinned_audio[:batch_size]
+    
+    def _audio_to_features(self, clips):
+        """Compute Whisper's log-mel input features for 16kHz clips on the model's device."""
+        # Pad/truncate every clip to Whisper's 30 s window on the host
+        host_audio = self._host_audio_buffer(len(clips))
+        host_audio.zero_()
+        for i, clip in enumerate(clips):
+            clip = torch.as_tensor(clip, dtype=torch.float32)[:self.N_SAMPLES]
+            host_audio[i, :len(clip)] = clip
+        
+        # One upload for the whole batch, asynchronous from pinned memory
+        audio = host_audio.to(self.device, non_blocking=True)
+        if self.device == "cuda":
+            self._upload_done.record()
+        
+        # Whisper drops the last STFT frame, leaving 3000 frames per window
+        mel = self._mel(audio)[..., :-1]
+        log_spec = torch.clamp(mel, min=1e-10).log10()
+        log_spec = torch.maximum(log_spec, log_spec.amax(dim=(1, 2), keepdim=True) - 8.0)
+        return (log_spec + 4.0) / 4.0
+    
+    def _clip_keys(self, clips):
+        """Encoder cache keys for 16kHz clips, hashed from the host audio rather than the uploaded features."""
+        return [
+            hashlib.sha1(torch.as_tensor(clip, dtype=torch.float32)[:self.N_SAMPLES].numpy().tobytes()).hexdigest()
+            for clip in clips
+        ]
+    
+    def _encode(self, input_features, keys):
+        """Run the encoder on clips missing from the cache, reusing cached outputs for the rest."""
+        misses = [i for i, key in enumerate(keys) if key not in self._encoder_cache]
+        if misses:
+            if len(misses) < len(keys):
+                input_features = input_features[misses]
+            input_features = input_features.to(self.device, self.model.dtype)
+            if self._encoder_graph is not None and input_features.shape == self._encoder_input.shape:
+                # Replay the captured encoder, its static output buffer is copied out below
+                self._encoder_input.copy_(input_features)
+                self._encoder_graph.replay()
+                hidden_states = self._encoder_output
+            else:
+                hidden_states = self.model.get_encoder()(input_features).last_hidden_state
+            # Cache a copy per clip, so an entry doesn't keep its whole batch's output alive
+            for i, clip_states in zip(misses, hidden_states):
+                self._encoder_cache[keys[i]] = clip_states.clone()
+        for key in keys:
+            self._encoder_cache.move_to_end(key)
+        # Stacking gives generate a fresh tensor, so it can't modify the cached entries
+        hidden_states = torch.stack([self._encoder_cache[key] for key in keys])
+        while len(self._encoder_cache) > self.ENCODER_CACHE_SIZE:
+            self._encoder_cache.popitem(last=False)
+        return BaseModelOutput(last_hidden_state=hidden_states)
+    
+    def _max_new_tokens(self, num_samples):
+        """Upper bound on generated tokens for a 16kHz clip of num_samples."""
+        # Leave room for the 4 prompt tokens within the decoder's context
+        limit = self.model.config.max_target_positions - 4
+        return min(limit, int(num_samples / 16000 * self.TOKENS_PER_SECOND) + 8)
+    
+    def decode_audio(self, source):
+        """Decode an audio file path or file-like object to a mono tensor and its sample rate."""
+        try:
+            # Decode with libsndfile and downmix to mono
+            data, sr = sf.read(source, dtype='float32', always_2d=False)
+            audio = torch.from_numpy(data)
+            if audio.ndim > 1:
+                audio = audio.mean(dim=1)
+        except sf.LibsndfileError:
+            # libsndfile can't read some containers (e.g. m4a/aac), let torchaudio decode those
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            try:
+                audio, sr = torchaudio.load(source)
+                audio = audio.mean(dim=0)
+            except Exception as e:
+                # torchaudio only links FFmpeg 4-6, newer installs still work through the ffmpeg command
+                logger.debug("torchaudio could not decode the audio, using ffmpeg: %s", e)
+                audio, sr = self._decode_with_ffmpeg(source)
+        return audio, sr
+    
+    def _decode_with_ffmpeg(self, source, sample_rate=16000):
+        """Decode an audio file path or file-like object to 16kHz mono with the ffmpeg command-line tool."""
+        if hasattr(source, 'read'):
+            # m4a files may keep their index at the end, which ffmpeg can't seek to through a pipe
+            source.seek(0)
+            with tempfile.NamedTemporaryFile() as tmp:
+                shutil.copyfileobj(source, tmp)
+                tmp.flush()
+                return self._decode_with_ffmpeg(tmp.name, sample_rate)
+        
+        result = subprocess.run(
+            ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", str(source),
+             "-f", "f32le", "-ac", "1", "-ar", str(sample_rate), "-"],
+            capture_output=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg could not decode the audio: {result.stderr.decode(errors='replace').strip()}")
+        return torch.frombuffer(bytearray(result.stdout), dtype=torch.float32), sample_rate
     
     def load_audio(self, audio_path, sample_rate=16000):
         """Load and preprocess audio file."""
         try:
-            print(f"Loading audio file: {audio_path}")
-            # Load audio file and resample to 16kHz (Whisper's expected sample rate)
-            audio, sr = librosa.load(audio_path, sr=sample_rate)
-            print(f"Audio loaded: {len(audio)/sample_rate:.2f} seconds")
+            logger.debug("Loading audio file: %s", audio_path)
+            audio, sr = self.decode_audio(audio_path)
+            
+            # Resample to 16kHz (Whisper's expected sample rate), no-op if already there
+            if sr != sample_rate:
+                audio = torchaudio.functional.resample(audio, sr, sample_rate)
+            logger.debug("Audio loaded: %.2f seconds", len(audio) / sample_rate)
             return audio
         except Exception as e:
-            print(f"Error loading audio file: {e}")
+            logger.error("Error loading audio file: %s", e)
             return None
     
+    def _chunk(self, audio, chunk_s=30, overlap_s=0.5):
+        """Split 16kHz audio into chunk_s windows that overlap by overlap_s."""
+        chunk = int(chunk_s * 16000)
+        overlap = int(overlap_s * 16000)
+        step = chunk - overlap
+        return [audio[start:start + chunk] for start in range(0, max(len(audio) - overlap, 1), step)]
+    
+    def _stitch(self, texts, max_overlap_words=8):
+        """Join chunk transcriptions, dropping words repeated across the chunk overlap."""
+        words = []
+        for text in texts:
+            new_words = text.split()
+            overlap = next(
+                (n for n in range(min(len(words), len(new_words), max_overlap_words), 0, -1)
+                 if words[-n:] == new_words[:n]),
+                0
+            )
+            words.extend(new_words[overlap:])
+        return " ".join(words)
+    
+    def transcribe_batch(self, clips, language="sv", batch_size=8, streamer=None):
+        """Transcribe 16kHz clips of at most 30 s, batch_size clips per generate call."""
+        transcriptions = []
+        for start in range(0, len(clips), batch_size):
+            batch = clips[start:start + batch_size]
+            
+            # Compute features for the whole batch, Whisper's encoder needs each clip padded to a full 30 s window
+            input_features = self._audio_to_features(batch)
+            
+            # Generate transcriptions, running the encoder once up front
+            with torch.no_grad(), torch.autocast(
+                device_type=self.device,
+                dtype=self.autocast_dtype,
+                enabled=self.autocast_dtype is not None
+            ):
+                if self.backend == "onnxruntime":
+                    # The ONNX encoder session runs inside generate
+                    model_inputs = {"input_features": input_features}
+                else:
+                    # Keys are hashed on the host while the batch's upload is still in flight
+                    model_inputs = {"encoder_outputs": self._encode(input_features, self._clip_keys(batch))}
+                predicted_ids = self.model.generate(
+                    **model_inputs,
+                    language=language,
+                    task="transcribe",
+                    num_beams=1,
+                    do_sample=False,
+                    max_new_tokens=self._max_new_tokens(max(len(clip) for clip in batch)),
+                    use_cache=True,
+                    streamer=streamer
+                )
+            
+            # Decode the whole batch at once
+            transcriptions.extend(
+                transcription.strip() for transcription in self.processor.batch_decode(
+                    predicted_ids, 
+                    skip_special_tokens=True
+                )
+            )
+        
+        return transcriptions
+    
+    def transcribe_audios(self, audios, language="sv", batch_size=8, streamer=None):
+        """Transcribe 16kHz audio of any length, batching the 30 s chunks of all inputs together."""
+        # Streamers only follow a single sequence, so streamed chunks are generated one at a time
+        if streamer is not None:
+            batch_size = 1
+        
+        chunks_per_audio = [self._chunk(audio) for audio in audios]
+        chunk_texts = self.transcribe_batch(
+            [chunk for chunks in chunks_per_audio for chunk in chunks],
+            language,
+            batch_size,
+            streamer
+        )
+        
+        # Reassemble each input's chunk transcriptions in order
+        transcriptions = []
+        for chunks in chunks_per_audio:
+            transcriptions.append(self._stitch(chunk_texts[:len(chunks)]))
+            chunk_texts = chunk_texts[len(chunks):]
+        return transcriptions
+    
+    def _to_16khz(self, audio, sr):
+        """Convert audio recorded at sample rate sr to a 16kHz tensor."""
+        audio = torch.as_tensor(audio)
+        if sr != 16000:
+            audio = torchaudio.functional.resample(audio, sr, 16000)
+        return audio
+    
+    def transcribe_audio_arrays(self, audios, sample_rates, language="sv"):
+        """Transcribe several in-memory recordings together, each at its own sample rate."""
+        try:
+            resampled = [self._to_16khz(audio, sr) for audio, sr in zip(audios, sample_rates)]
+            
+            if self.backend == "ctranslate2":
+                return [self._transcribe_ctranslate2(audio.numpy(), language) for audio in resampled]
+            
+            return self.transcribe_audios(resampled, language)
+            
+        except Exception as e:
+            raise Exception(f"Transcription error: {str(e)}")
+    
+    def transcribe_audio_array(self, audio, sr, language="sv", text_queue=None):
+        """Transcribe in-memory audio recorded at sample rate sr.
+        
+        If text_queue is given, decoded text is pushed to it while generating.
+        """
+        if text_queue is None:
+            return self.transcribe_audio_arrays([audio], [sr], language)[0]
+        
+        try:
+            audio = self._to_16khz(audio, sr)
+            
+            if self.backend == "ctranslate2":
+                return self._transcribe_ctranslate2(audio.numpy(), language, text_queue)
+            
+            streamer = TokenQueueStreamer(self.processor.tokenizer, text_queue)
+            return self.transcribe_audios([audio], language, streamer=streamer)[0]
+            
+        except Exception as e:
+            raise Exception(f"Transcription error: {str(e)}")
+    
     def transcribe_audio(self, audio_path, language="sv"):
         """Transcribe audio file to Swedish text."""
+        if self.backend == "ctranslate2":
+            try:
+                logger.debug("Generating transcription...")
+                return self._transcribe_ctranslate2(audio_path, language)
+            except Exception as e:
+                logger.error("Error during transcription: %s", e)
+                return None
+        
         # Load audio
         audio = self.load_audio(audio_path)
         if audio is None:
             return None
         
         try:
-            print("Processing audio...")
-            
-            # Process audio with the processor
-            inputs = self.processor(
-                audio, 
-                sampling_rate=16000, 
-                return_tensors="pt"
-            ).to(self.device)
-            
-            # Generate transcription
-            print("Generating transcription...")
-            with torch.no_grad():
-                predicted_ids = self.model.generate(
-                    inputs.input_features,
-                    language=language,
-                    task="transcribe"
-                )
-            
-            # Decode the transcription
-            transcription = self.processor.batch_decode(
-                predicted_ids, 
-                skip_special_tokens=True
-            )[0]
-            
-            return transcription.strip()
+            logger.debug("Generating transcription...")
+            return self.transcribe_audios([audio], language)[0]
             
         except Exception as e:
-            print(f"Error during transcription: {e}")
+            logger.error("Error during transcription: %s", e)
             return None
     
+    def save_transcription(self, transcription, output_path):
+        """Write a transcription to a text file."""
+        try:
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(transcription)
+            logger.info("Transcription saved to: %s", output_path)
+            return True
+        except Exception as e:
+            logger.error("Error saving transcription: %s", e)
+            return False
+    
     def transcribe_file(self, input_path, output_path=None):
         """Transcribe a single audio file and optionally save to file."""
         if not os.path.exists(input_path):
-            print(f"Error: Audio file '{input_path}' not found.")
+            logger.error("Error: Audio file '%s' not found.", input_path)
             return False
         
         # Transcribe the audio
         transcription = self.transcribe_audio(input_path)
         
         if transcription is None:
-            print("Transcription failed.")
+            logger.error("Transcription failed.")
             return False
         
         print(f"\n--- Transcription ---")
@@ -105,21 +546,15 @@ class SwedishTranscriber:
         
         # Save to file if output path is specified
         if output_path:
-            try:
-                with open(output_path, 'w', encoding='utf-8') as f:
-                    f.write(transcription)
-                print(f"Transcription saved to: {output_path}")
-            except Exception as e:
-                print(f"Error saving transcription: {e}")
-                return False
+            return self.save_transcription(transcription, output_path)
         
         return True
     
-    def transcribe_directory(self, input_dir, output_dir=None):
-        """Transcribe all audio files in a directory."""
+    def transcribe_directory(self, input_dir, output_dir=None, batch_size=8):
+        """Transcribe all audio files in a directory, batch_size files per generate call."""
         input_path = Path(input_dir)
         if not input_path.exists():
-            print(f"Error: Directory '{input_dir}' not found.")
+            logger.error("Error: Directory '%s' not found.", input_dir)
             return
         
         # Common audio file extensions
@@ -128,27 +563,51 @@ class SwedishTranscriber:
                       if f.suffix.lower() in audio_extensions]
         
         if not audio_files:
-            print(f"No audio files found in '{input_dir}'")
+            logger.warning("No audio files found in '%s'", input_dir)
             return
         
-        print(f"Found {len(audio_files)} audio files to transcribe.")
+        logger.info("Found %d audio files to transcribe.", len(audio_files))
         
         # Create output directory if specified
         if output_dir:
             output_path = Path(output_dir)
             output_path.mkdir(parents=True, exist_ok=True)
         
-        # Process each audio file
-        for i, audio_file in enumerate(audio_files, 1):
-            print(f"\n[{i}/{len(audio_files)}] Processing: {audio_file.name}")
-            
-            # Determine output file path
-            if output_dir:
-                output_file = output_path / f"{audio_file.stem}_transcription.txt"
-            else:
-                output_file = None
-            
-            self.transcribe_file(str(audio_file), str(output_file) if output_file else None)
+        # faster-whisper decodes each file itself, so process them one at a time
+        if self.backend == "ctranslate2":
+            for i, audio_file in enumerate(audio_files, 1):
+                logger.info("\n[%d/%d] Processing: %s", i, len(audio_files), audio_file.name)
+                output_file = output_path / f"{audio_file.stem}_transcription.txt" if output_dir else None
+                self.transcribe_file(str(audio_file), str(output_file) if output_file else None)
+            return
+        
+        with ThreadPoolExecutor() as executor:
+            for start in range(0, len(audio_files), batch_size):
+                batch_files = audio_files[start:start + batch_size]
+                logger.info("\n[%d-%d/%d] Processing: %s", start + 1, start + len(batch_files),
+                            len(audio_files), ', '.join(f.name for f in batch_files))
+                
+                # Decode the batch's audio files concurrently
+                audios = list(executor.map(self.load_audio, batch_files))
+                loaded = [(f, audio) for f, audio in zip(batch_files, audios) if audio is not None]
+                if not loaded:
+                    continue
+                
+                try:
+                    transcriptions = self.transcribe_audios([audio for _, audio in loaded], batch_size=batch_size)
+                except Exception as e:
+                    logger.error("Error during transcription: %s", e)
+                    continue
+                
+                for (audio_file, _), transcription in zip(loaded, transcriptions):
+                    print(f"\n--- Transcription: {audio_file.name} ---")
+                    print(transcription)
+                    print(f"--- End Transcription ---")
+                
+                # Write the batch's results concurrently
+                if output_dir:
+                    output_files = [output_path / f"{f.stem}_transcription.txt" for f, _ in loaded]
+                    list(executor.map(self.save_transcription, transcriptions, output_files))
 
 def main():
     parser = argparse.ArgumentParser(
@@ -167,11 +626,30 @@ def main():
         default="KBLab/kb-whisper-large",
         help="Model name to use (default: KBLab/kb-whisper-large)"
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=8,
+        help="Number of files transcribed together when processing a directory (default: 8)"
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="Compile the model with torch.compile on GPU, worth the extra startup time for large directories"
+    )
     
     args = parser.parse_args()
     
+    # Show the transcriber's progress messages on the command line
+    logging.basicConfig(format="%(message)s")
+    logger.setLevel(logging.DEBUG)
+    
     # Initialize transcriber
-    transcriber = SwedishTranscriber(args.model)
+    try:
+        transcriber = SwedishTranscriber(args.model, compile_model=args.compile)
+    except Exception as e:
+        logger.error("Error loading model: %s", e)
+        sys.exit(1)
     
     # Check if input is a file or directory
     input_path = Path(args.input)
@@ -181,7 +659,7 @@ def main():
         transcriber.transcribe_file(args.input, args.output)
     elif input_path.is_dir():
         # Transcribe all files in directory
-        transcriber.transcribe_directory(args.input, args.output)
+        transcriber.transcribe_directory(args.input, args.output, args.batch_size)
     else:
         print(f"Error: '{args.input}' is not a valid file or directory.")
         sys.exit(1)
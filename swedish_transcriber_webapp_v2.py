@@ -4,18 +4,17 @@ Swedish Speech Transcription Web App
 Flask web application with pre-loaded model for fast transcriptions
 """
 
-import os
+import io
+import json
 import tempfile
 import time
 from pathlib import Path
-import torch
-from transformers import WhisperProcessor, WhisperForConditionalGeneration
-import librosa
+from queue import Queue, Empty, Full
 import warnings
-from flask import Flask, request, render_template_string, jsonify, send_file
-from werkzeug.utils import secure_filename
+from flask import Flask, Response, request, make_response, jsonify, send_file, stream_with_context
 import threading
 import logging
+from swedish_transcriber import SwedishTranscriber
 
 # Suppress warnings
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -23,67 +22,98 @@ logging.getLogger('transformers').setLevel(logging.ERROR)
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
-app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
+app.config['IN_MEMORY_UPLOAD_LIMIT'] = 50 * 1024 * 1024  # Larger uploads are decoded from werkzeug's spooled temp file
+app.config['TRANSCRIBE_TIMEOUT'] = 600  # Seconds a request waits for its queued transcription
 
-# Global variables for the model
+# Global model, loaded in main() before the server starts
 transcriber = None
-model_loading = True
-model_load_error = None
 
-class SwedishTranscriber:
-    def __init__(self, model_name="KBLab/kb-whisper-large"):
-        print(f"Loading model: {model_name}")
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"Using device: {self.device}")
+# Pending transcriptions, served by a single worker so only one inference runs at a time
+INFER_Q = Queue(maxsize=32)
+# Maximum number of queued requests transcribed together in one batch
+MAX_COALESCED_JOBS = 8
+
+def run_job(job):
+    """Transcribe a single queued job, streaming its text if it asked for that."""
+    try:
+        job['transcription'] = transcriber.transcribe_audio_array(
+            job['audio'], job['sr'], text_queue=job['text_queue'] if job['stream_tokens'] else None
+        )
+    except Exception as e:
+        job['error'] = str(e)
+
+def finish_job(job):
+    job['done'].set()
+    if job['text_queue'] is not None:
+        # Sentinel telling the response stream that no more text is coming
+        job['text_queue'].put(None)
+
+def inference_worker():
+    """Serve queued transcriptions, batching together plain requests that are already waiting."""
+    while True:
+        jobs = [INFER_Q.get()]
+        while len(jobs) < MAX_COALESCED_JOBS:
+            try:
+                jobs.append(INFER_Q.get_nowait())
+            except Empty:
+                break
         
-        self.processor = WhisperProcessor.from_pretrained(model_name)
-        self.model = WhisperForConditionalGeneration.from_pretrained(model_name)
-        self.model.to(self.device)
-        print("Model loaded successfully!")
-    
-    def transcribe_audio_file(self, audio_path, language="sv"):
-        try:
-            # Load and preprocess audio
-            audio, sr = librosa.load(audio_path, sr=16000)
-            
-            # Process audio
-            inputs = self.processor(
-                audio, 
-                sampling_rate=16000, 
-                return_tensors="pt"
-            ).to(self.device)
-            
-            # Generate transcription
-            with torch.no_grad():
-                predicted_ids = self.model.generate(
-                    inputs.input_features,
-                    language=language,
-                    task="transcribe"
+        # Requests that stopped waiting are finished without spending inference on them
+        for job in jobs:
+            if job['cancelled']:
+                finish_job(job)
+        jobs = [job for job in jobs if not job['cancelled']]
+        
+        # Token-streamed jobs are decoded one sequence at a time, so they can't join the batch
+        batch = [job for job in jobs if not job['stream_tokens']]
+        streamed = [job for job in jobs if job['stream_tokens']]
+        
+        if batch:
+            try:
+                transcriptions = transcriber.transcribe_audio_arrays(
+                    [job['audio'] for job in batch],
+                    [job['sr'] for job in batch]
                 )
-            
-            # Decode transcription
-            transcription = self.processor.batch_decode(
-                predicted_ids, 
-                skip_special_tokens=True
-            )[0]
-            
-            return transcription.strip()
-            
-        except Exception as e:
-            raise Exception(f"Transcription error: {str(e)}")
+                for job, transcription in zip(batch, transcriptions):
+                    job['transcription'] = transcription
+            except Exception:
+                # Retry one by one so a single bad upload doesn't fail the whole batch
+                for job in batch:
+                    run_job(job)
+            for job in batch:
+                finish_job(job)
+        
+        for job in streamed:
+            # Earlier streamed jobs may have run long enough for this one's client to give up
+            if not job['cancelled']:
+                run_job(job)
+            finish_job(job)
 
-def load_model():
-    """Load the model in a separate thread"""
-    global transcriber, model_loading, model_load_error
-    
+def stream_transcription(job, start_time):
+    """Yield NDJSON lines: text deltas as they are decoded, then the final transcription."""
     try:
-        transcriber = SwedishTranscriber()
-        model_loading = False
-        print("Model ready for transcriptions!")
-    except Exception as e:
-        model_load_error = str(e)
-        model_loading = False
-        print(f"Error loading model: {e}")
+        deadline = start_time + app.config['TRANSCRIBE_TIMEOUT']
+        while True:
+            try:
+                text = job['text_queue'].get(timeout=max(0, deadline - time.time()))
+            except Empty:
+                yield json.dumps({'error': 'Transcription timed out'}) + '\n'
+                return
+            if text is None:
+                break
+            yield json.dumps({'delta': text}) + '\n'
+        
+        if 'error' in job:
+            yield json.dumps({'error': job['error']}) + '\n'
+        else:
+            yield json.dumps({
+                'transcription': job['transcription'],
+                'processing_time': f"{time.time() - start_time:.2f} seconds"
+            }) + '\n'
+    finally:
+        # Timed out, or the client disconnected and the stream was closed early
+        if not job['done'].is_set():
+            job['cancelled'] = True
 
 # HTML template for the web interface
 HTML_TEMPLATE = """
@@ -277,28 +307,24 @@ HTML_TEMPLATE = """
         let selectedFile = null;
         let currentTranscription = null;
 
-        // Check model status
-        function checkModelStatus() {
-            fetch('/status')
-                .then(response => response.json())
-                .then(data => {
-                    const statusDiv = document.getElementById('modelStatus');
-                    const uploadBtn = document.getElementById('uploadBtn');
-                    
-                    if (data.loading) {
-                        statusDiv.className = 'status loading';
-                        statusDiv.textContent = 'Loading model... Please wait.';
-                        uploadBtn.disabled = true;
-                    } else if (data.error) {
-                        statusDiv.className = 'status error';
-                        statusDiv.textContent = `Error: ${data.error}`;
-                        uploadBtn.disabled = true;
-                    } else {
-                        statusDiv.className = 'status ready';
-                        statusDiv.textContent = '✓ Model ready! You can now upload audio files.';
-                        uploadBtn.disabled = false;
-                    }
-                });
+        // Show model status
+        function showModelStatus(data) {
+            const statusDiv = document.getElementById('modelStatus');
+            const uploadBtn = document.getElementById('uploadBtn');
+            
+            if (data.loading) {
+                statusDiv.className = 'status loading';
+                statusDiv.textContent = 'Loading model... Please wait.';
+                uploadBtn.disabled = true;
+            } else if (data.error) {
+                statusDiv.className = 'status error';
+                statusDiv.textContent = `Error: ${data.error}`;
+                uploadBtn.disabled = true;
+            } else {
+                statusDiv.className = 'status ready';
+                statusDiv.textContent = '✓ Model ready! You can now upload audio files.';
+                uploadBtn.disabled = false;
+            }
         }
 
         // Handle file selection
@@ -333,6 +359,21 @@ HTML_TEMPLATE = """
             }
         });
 
+        // Handle one message from /transcribe
+        function handleTranscriptionMessage(data) {
+            if (data.error) {
+                alert('Error: ' + data.error);
+            } else if (data.delta !== undefined) {
+                document.getElementById('transcriptionResult').textContent += data.delta;
+            } else {
+                currentTranscription = data.transcription;
+                document.getElementById('transcriptionResult').textContent = data.transcription;
+                document.getElementById('resultArea').style.display = 'block';
+                document.getElementById('downloadBtn').style.display = 'inline-block';
+                document.getElementById('downloadBtn').href = '/download?text=' + encodeURIComponent(data.transcription) + '&filename=' + encodeURIComponent(selectedFile.name);
+            }
+        }
+
         // Transcribe audio
         function transcribeAudio() {
             if (!selectedFile) return;
@@ -347,23 +388,37 @@ HTML_TEMPLATE = """
             
             fetch('/transcribe', {
                 method: 'POST',
+                headers: { 'Accept': 'application/x-ndjson' },
                 body: formData
             })
-            .then(response => response.json())
-            .then(data => {
-                document.getElementById('loadingSpinner').style.display = 'none';
-                document.getElementById('transcribeBtn').disabled = false;
+            .then(async response => {
+                // Errors raised before transcription starts come back as a single JSON object
+                if (!(response.headers.get('Content-Type') || '').includes('application/x-ndjson')) {
+                    handleTranscriptionMessage(await response.json());
+                    return;
+                }
                 
-                if (data.error) {
-                    alert('Error: ' + data.error);
-                } else {
-                    currentTranscription = data.transcription;
-                    document.getElementById('transcriptionResult').textContent = data.transcription;
-                    document.getElementById('resultArea').style.display = 'block';
-                    document.getElementById('downloadBtn').style.display = 'inline-block';
-                    document.getElementById('downloadBtn').href = '/download?text=' + encodeURIComponent(data.transcription) + '&filename=' + encodeURIComponent(selectedFile.name);
+                // Show the text as it is decoded
+                document.getElementById('transcriptionResult').textContent = '';
+                document.getElementById('downloadBtn').style.display = 'none';
+                document.getElementById('resultArea').style.display = 'block';
+                
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split('\\n');
+                    buffer = lines.pop();
+                    lines.filter(line => line.trim()).forEach(line => handleTranscriptionMessage(JSON.parse(line)));
                 }
             })
+            .then(() => {
+                document.getElementById('loadingSpinner').style.display = 'none';
+                document.getElementById('transcribeBtn').disabled = false;
+            })
             .catch(error => {
                 document.getElementById('loadingSpinner').style.display = 'none';
                 document.getElementById('transcribeBtn').disabled = false;
@@ -371,36 +426,46 @@ HTML_TEMPLATE = """
             });
         }
 
-        // Check model status on page load and periodically
-        checkModelStatus();
-        const statusInterval = setInterval(() => {
-            checkModelStatus();
-            fetch('/status')
-                .then(response => response.json())
-                .then(data => {
-                    if (!data.loading) {
-                        clearInterval(statusInterval);
-                    }
-                });
-        }, 2000);
+        // Listen for the model status on a single stream instead of polling
+        const statusSource = new EventSource('/status/stream');
+        statusSource.onmessage = (event) => {
+            const data = JSON.parse(event.data);
+            showModelStatus(data);
+            if (!data.loading) {
+                // Close so the browser doesn't reconnect once the server ends the stream
+                statusSource.close();
+            }
+        };
     </script>
 </body>
 </html>
 """
 
+# Compiled once at import rather than on every request
+INDEX_TEMPLATE = app.jinja_env.from_string(HTML_TEMPLATE)
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    response = make_response(INDEX_TEMPLATE.render())
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
 
 @app.route('/status')
 def status():
-    global model_loading, model_load_error, transcriber
+    # The model is loaded before the server starts accepting requests
     return jsonify({
-        'loading': model_loading,
-        'ready': transcriber is not None,
-        'error': model_load_error
+        'loading': False,
+        'ready': True
     })
 
+@app.route('/status/stream')
+def status_stream():
+    def generate():
+        # The model is loaded before the server starts, so readiness is sent straight away
+        yield f"data: {json.dumps({'loading': False, 'ready': True})}\n\n"
+    
+    return Response(generate(), mimetype='text/event-stream')
+
 @app.route('/transcribe', methods=['POST'])
 def transcribe():
     global transcriber
@@ -416,18 +481,48 @@ def transcribe():
         return jsonify({'error': 'No file selected'}), 400
     
     try:
-        # Save uploaded file temporarily
-        filename = secure_filename(file.filename)
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(temp_path)
-        
-        # Transcribe
         start_time = time.time()
-        transcription = transcriber.transcribe_audio_file(temp_path)
-        processing_time = time.time() - start_time
         
-        # Clean up temp file
-        os.unlink(temp_path)
+        # Decode the upload straight from the request, large ones from werkzeug's spooled file
+        if request.content_length and request.content_length > app.config['IN_MEMORY_UPLOAD_LIMIT']:
+            audio, sr = transcriber.decode_audio(file.stream)
+        else:
+            audio, sr = transcriber.decode_audio(io.BytesIO(file.read()))
+        
+        # Clients that accept NDJSON get the text streamed while it is decoded. Streaming generates
+        # one chunk at a time, so only recordings within a single 30 s window are streamed, longer
+        # ones stay on the batched path and arrive as a single final message.
+        stream = request.accept_mimetypes.best == 'application/x-ndjson'
+        
+        # Hand the audio to the inference worker
+        job = {
+            'audio': audio,
+            'sr': sr,
+            'done': threading.Event(),
+            'text_queue': Queue() if stream else None,
+            'stream_tokens': stream and len(audio) <= 30 * sr,
+            'cancelled': False
+        }
+        try:
+            INFER_Q.put_nowait(job)
+        except Full:
+            return jsonify({'error': 'Server is busy, please try again shortly'}), 503
+        
+        if stream:
+            return Response(
+                stream_with_context(stream_transcription(job, start_time)),
+                mimetype='application/x-ndjson'
+            )
+        
+        if not job['done'].wait(timeout=app.config['TRANSCRIBE_TIMEOUT']):
+            # Nobody is waiting for the result anymore, let the worker skip it
+            job['cancelled'] = True
+            return jsonify({'error': 'Transcription timed out'}), 504
+        if 'error' in job:
+            return jsonify({'error': job['error']}), 500
+        
+        transcription = job['transcription']
+        processing_time = time.time() - start_time
         
         return jsonify({
             'transcription': transcription,
@@ -435,9 +530,6 @@ def transcribe():
         })
         
     except Exception as e:
-        # Clean up temp file if it exists
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            os.unlink(temp_path)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/download')
@@ -478,13 +570,25 @@ def find_free_port(start_port=5001):
     raise RuntimeError("No free ports found")
 
 def main():
+    global transcriber
+    
     print("Starting Swedish Transcriber Web App...")
-    print("Model will be loaded in the background...")
+    print("Loading model before starting the server, this may take a few minutes...")
+    
+    # Show the transcriber's loading progress, its per-request messages are debug level and stay hidden
+    logging.basicConfig(format="%(message)s")
+    logging.getLogger(SwedishTranscriber.__module__).setLevel(logging.INFO)
+    
+    try:
+        # The server runs for a long time, so compiling up front pays for itself
+        transcriber = SwedishTranscriber(compile_model=True)
+    except Exception as e:
+        print(f"Error loading model: {e}")
+        return
+    print("Model ready for transcriptions!")
     
-    # Start model loading in background thread
-    model_thread = threading.Thread(target=load_model)
-    model_thread.daemon = True
-    model_thread.start()
+    # Single inference worker, fed by /transcribe through INFER_Q
+    threading.Thread(target=inference_worker, daemon=True).start()
     
     # Find a free port
     try:
@@ -496,8 +600,7 @@ def main():
     print("\n" + "="*50)
     print("🚀 Web app starting!")
     print(f"📝 Open your browser and go to: http://localhost:{port}")
-    print("⏳ The model will load in the background...")
-    print("✅ Once loaded, you can transcribe audio files instantly!")
+    print("✅ Model loaded, you can transcribe audio files instantly!")
     print("="*50 + "\n")
     
     try: